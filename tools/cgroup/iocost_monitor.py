@@ -14,11 +14,29 @@ import re
 import time
 import json
 import math
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+# numpy vectorizes the per-slot usage percentage conversion, but don't
+# require it.
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# orjson encodes several times faster than the stdlib and takes the
+# fast path for native numbers, but don't require it either.
+try:
+    import orjson
+    def json_dumps(obj):
+        return orjson.dumps(obj).decode('utf-8')
+except ImportError:
+    def json_dumps(obj):
+        return json.dumps(obj)
 
 import drgn
-from drgn import container_of
 from drgn.helpers.linux.list import list_for_each_entry,list_empty
-from drgn.helpers.linux.radixtree import radix_tree_for_each,radix_tree_lookup
+from drgn.helpers.linux.radixtree import radix_tree_for_each
 
 import argparse
 parser = argparse.ArgumentParser(description=desc,
@@ -29,6 +47,8 @@ parser.add_argument('--cgroup', action='append', metavar='REGEX',
                     help='Regex for target cgroups, ')
 parser.add_argument('--interval', '-i', metavar='SECONDS', type=float, default=1,
                     help='Monitoring interval in seconds')
+parser.add_argument('--refresh-every', metavar='TICKS', type=int, default=10,
+                    help='Force cgroup tree rewalk every TICKS intervals')
 parser.add_argument('--json', action='store_true',
                     help='Output in json')
 args = parser.parse_args()
@@ -43,6 +63,7 @@ try:
 except:
     err('The kernel does not have iocost enabled')
 
+CSS_ONLINE      = prog['CSS_ONLINE'].value_()
 IOC_RUNNING     = prog['IOC_RUNNING'].value_()
 NR_USAGE_SLOTS  = prog['NR_USAGE_SLOTS'].value_()
 HWEIGHT_WHOLE   = prog['HWEIGHT_WHOLE'].value_()
@@ -60,150 +81,290 @@ autop_names = {
     AUTOP_HDD:             'hdd',
 }
 
-class BlkgIterator:
-    def blkcg_name(blkcg):
-        return blkcg.css.cgroup.kn.name.string_().decode('utf-8')
-
-    def walk(self, blkcg, q_id, parent_path):
-        if not self.include_dying and \
-           not (blkcg.css.flags.value_() & prog['CSS_ONLINE'].value_()):
-            return
+# Resolve the types we instantiate repeatedly once, so per-object
+# creation doesn't go through drgn's type-name lookup every time.
+BLKCG_GQ_T      = prog.type('struct blkcg_gq')
+IOC_GQ_T        = prog.type('struct ioc_gq')
+IOC_GQ_PTR_T    = prog.type('struct ioc_gq *')
+IOC_GQ_PD_OFFSET = drgn.offsetof(IOC_GQ_T, 'pd')
+
+def pd_to_iocg(pd):
+    # Pre-resolved equivalent of container_of(pd, 'struct ioc_gq', 'pd')
+    return drgn.Object(prog, IOC_GQ_PTR_T,
+                       value=pd.value_() - IOC_GQ_PD_OFFSET)
+
+# Each .value_() is a separate round-trip through drgn into kernel
+# memory.  Instead, slurp a whole struct with one prog.read() and unpack
+# the interesting fields from the raw buffer at offsets resolved once at
+# startup.
+def struct_field(typ, member, fmt):
+    return (drgn.offsetof(typ, member), struct.Struct(fmt))
+
+def read_field(buf, field):
+    offset, fmt = field
+    return fmt.unpack_from(buf, offset)[0]
+
+IOC_GQ_SIZE             = drgn.sizeof(IOC_GQ_T)
+IOC_GQ_WEIGHT           = struct_field(IOC_GQ_T, 'weight', '=I')
+IOC_GQ_ACTIVE           = struct_field(IOC_GQ_T, 'active', '=I')
+IOC_GQ_INUSE            = struct_field(IOC_GQ_T, 'inuse', '=I')
+IOC_GQ_HWEIGHT_ACTIVE   = struct_field(IOC_GQ_T, 'hweight_active', '=I')
+IOC_GQ_HWEIGHT_INUSE    = struct_field(IOC_GQ_T, 'hweight_inuse', '=I')
+IOC_GQ_VTIME            = struct_field(IOC_GQ_T, 'vtime.counter', '=q')
+IOC_GQ_DONE_VTIME       = struct_field(IOC_GQ_T, 'done_vtime.counter', '=q')
+IOC_GQ_ABS_VDEBT        = struct_field(IOC_GQ_T, 'abs_vdebt.counter', '=q')
+IOC_GQ_USAGE_IDX        = struct_field(IOC_GQ_T, 'usage_idx', '=i')
+IOC_GQ_USAGES           = struct_field(IOC_GQ_T, 'usages',
+                                       '=' + 'I' * NR_USAGE_SLOTS)
+IOC_GQ_IOC              = struct_field(IOC_GQ_T, 'ioc', '=Q')
+IOC_GQ_PD_BLKG          = struct_field(IOC_GQ_T, 'pd.blkg', '=Q')
+IOC_GQ_ACTIVE_NEXT      = struct_field(IOC_GQ_T, 'active_list.next', '=Q')
+IOC_GQ_ACTIVE_OFFSET    = drgn.offsetof(IOC_GQ_T, 'active_list')
+
+BLKCG_GQ_SIZE           = drgn.sizeof(BLKCG_GQ_T)
+BLKCG_GQ_USE_DELAY      = struct_field(BLKCG_GQ_T, 'use_delay.counter', '=i')
+BLKCG_GQ_DELAY_NSEC     = struct_field(BLKCG_GQ_T, 'delay_nsec.counter', '=q')
+
+IOC_T                   = prog.type('struct ioc')
+IOC_SIZE                = drgn.sizeof(IOC_T)
+IOC_ENABLED             = struct_field(IOC_T, 'enabled', '=?')
+IOC_RUNNING_F           = struct_field(IOC_T, 'running', '=i')
+IOC_PERIOD_US           = struct_field(IOC_T, 'period_us', '=I')
+IOC_PERIOD_AT           = struct_field(IOC_T, 'period_at', '=I')
+IOC_PERIOD_AT_VTIME     = struct_field(IOC_T, 'period_at_vtime', '=Q')
+IOC_VTIME_RATE          = struct_field(IOC_T, 'vtime_rate.counter', '=q')
+IOC_BUSY_LEVEL          = struct_field(IOC_T, 'busy_level', '=i')
+IOC_AUTOP_IDX           = struct_field(IOC_T, 'autop_idx', '=i')
 
-        name = BlkgIterator.blkcg_name(blkcg)
-        path = parent_path + '/' + name if parent_path else name
-        blkg = drgn.Object(prog, 'struct blkcg_gq',
-                           address=radix_tree_lookup(blkcg.blkg_tree, q_id))
-        if not blkg.address_:
-            return
-
-        self.blkgs.append((path if path else '/', blkg))
-
-        for c in list_for_each_entry('struct blkcg',
-                                     blkcg.css.children.address_of_(), 'css.sibling'):
-            self.walk(c, q_id, path)
-
-    def __init__(self, root_blkcg, q_id, include_dying=False):
+class BlkgIterator:
+    # blkcg address -> path.  Stable until cgroups are created or
+    # destroyed; flushed whenever the population changes so a reused
+    # address can't resurrect a stale path.
+    path_cache = {}
+
+    def blkcg_path(blkcg):
+        # Walk kernfs parents towards the root; the root node itself
+        # doesn't contribute a path component.  Paths stay bytes until a
+        # row is actually emitted, skipping the utf-8 decode for
+        # everything the filter drops.
+        names = []
+        kn = blkcg.css.cgroup.kn
+        while kn.parent.value_():
+            names.append(kn.name.string_())
+            kn = kn.parent
+        names.reverse()
+        return b'/'.join(names) or b'/'
+
+    def __init__(self, root_blkcg, q, include_dying=False, refresh_every=1):
+        self.root_blkcg = root_blkcg
+        self.q = q
         self.include_dying = include_dying
+        self.refresh_every = refresh_every
         self.blkgs = []
-        self.walk(root_blkcg, q_id, '')
+        self.valid = False
+        self.nr_cgrps = None
+        self.ticks_since_walk = 0
+        self.refresh()
+
+    def refresh(self):
+        # The hierarchy rarely changes relative to the sampling tick.
+        # Rewalk only when the cgroup population changed, with a periodic
+        # forced rewalk to catch blkgs created or destroyed without a
+        # matching population change.
+        nr_cgrps = self.root_blkcg.css.cgroup.root.nr_cgrps.counter.value_()
+        self.ticks_since_walk += 1
+        # Only a fully-consumed rewalk() may flip valid to True; refresh()
+        # can merely keep an already-valid cache alive.
+        self.valid = self.valid and nr_cgrps == self.nr_cgrps and \
+                     self.ticks_since_walk < self.refresh_every
+        if not self.valid:
+            if nr_cgrps != self.nr_cgrps:
+                BlkgIterator.path_cache.clear()
+            self.nr_cgrps = nr_cgrps
+            self.ticks_since_walk = 0
 
     def __iter__(self):
-        return iter(self.blkgs)
+        # Steady-state fast path: no walk, no generator frame, just the
+        # cached list's own iterator.
+        if self.valid:
+            return iter(self.blkgs)
+        return self.rewalk()
+
+    def rewalk(self):
+        # Every blkg of this queue is already on q->blkg_list.  Walking
+        # that flat list costs one list hop per blkg instead of a radix
+        # tree lookup per cgroup in the whole hierarchy, most of which
+        # have no blkg for this queue.  Yield each entry as it is
+        # visited while refilling the cache, so a rewalk tick streams
+        # into stat collection instead of materializing first.
+        blkgs = []
+        for blkg in list_for_each_entry(BLKCG_GQ_T,
+                                        self.q.blkg_list.address_of_(),
+                                        'q_node'):
+            blkcg = blkg.blkcg
+            if not self.include_dying and \
+               not (blkcg.css.flags.value_() & CSS_ONLINE):
+                continue
+            addr = blkcg.value_()
+            path = BlkgIterator.path_cache.get(addr)
+            if path is None:
+                path = BlkgIterator.blkcg_path(blkcg)
+                BlkgIterator.path_cache[addr] = path
+            pair = (path, blkg)
+            blkgs.append(pair)
+            yield pair
+
+        self.blkgs = blkgs
+        self.valid = True
 
 class IocStat:
+    __slots__ = ('enabled', 'running', 'period_ms', 'period_at',
+                 'vperiod_at', 'vrate_pct', 'busy_level', 'autop_idx',
+                 'user_cost_model', 'user_qos_params', 'autop_name')
+
     def __init__(self, ioc):
-        global autop_names
-
-        self.enabled = ioc.enabled.value_()
-        self.running = ioc.running.value_() == IOC_RUNNING
-        self.period_ms = ioc.period_us.value_() / 1_000
-        self.period_at = ioc.period_at.value_() / 1_000_000
-        self.vperiod_at = ioc.period_at_vtime.value_() / VTIME_PER_SEC
-        self.vrate_pct = ioc.vtime_rate.counter.value_() * 100 / VTIME_PER_USEC
-        self.busy_level = ioc.busy_level.value_()
-        self.autop_idx = ioc.autop_idx.value_()
+        buf = prog.read(ioc.value_(), IOC_SIZE)
+
+        self.enabled = read_field(buf, IOC_ENABLED)
+        self.running = read_field(buf, IOC_RUNNING_F) == IOC_RUNNING
+        self.period_ms = read_field(buf, IOC_PERIOD_US) / 1_000
+        self.period_at = read_field(buf, IOC_PERIOD_AT) / 1_000_000
+        self.vperiod_at = read_field(buf, IOC_PERIOD_AT_VTIME) / VTIME_PER_SEC
+        self.vrate_pct = read_field(buf, IOC_VTIME_RATE) * 100 / VTIME_PER_USEC
+        self.busy_level = read_field(buf, IOC_BUSY_LEVEL)
+        self.autop_idx = read_field(buf, IOC_AUTOP_IDX)
+        # bitfields can't be unpacked from the raw buffer
         self.user_cost_model = ioc.user_cost_model.value_()
         self.user_qos_params = ioc.user_qos_params.value_()
 
-        if self.autop_idx in autop_names:
-            self.autop_name = autop_names[self.autop_idx]
-        else:
-            self.autop_name = '?'
+        self.autop_name = autop_names.get(self.autop_idx, '?')
 
     def dict(self, now):
         return { 'device'               : devname,
-                 'timestamp'            : str(now),
-                 'enabled'              : str(int(self.enabled)),
-                 'running'              : str(int(self.running)),
-                 'period_ms'            : str(self.period_ms),
-                 'period_at'            : str(self.period_at),
-                 'period_vtime_at'      : str(self.vperiod_at),
-                 'busy_level'           : str(self.busy_level),
-                 'vrate_pct'            : str(self.vrate_pct), }
+                 'timestamp'            : now,
+                 'enabled'              : int(self.enabled),
+                 'running'              : int(self.running),
+                 'period_ms'            : self.period_ms,
+                 'period_at'            : self.period_at,
+                 'period_vtime_at'      : self.vperiod_at,
+                 'busy_level'           : self.busy_level,
+                 'vrate_pct'            : self.vrate_pct, }
+
+    def stable_key(self):
+        return (self.enabled, self.running, self.period_ms, self.autop_name,
+                self.user_cost_model, self.user_qos_params)
+
+    # Only cur_per, busy and vrate change tick to tick.  Cache the
+    # formatted head and tail of the preamble and rebuild them only when
+    # one of their inputs changes.
+    preamble_key = None
+    preamble_head = None
+    preamble_tail = None
 
     def table_preamble_str(self):
-        state = ('RUN' if self.running else 'IDLE') if self.enabled else 'OFF'
-        output = f'{devname} {state:4} ' \
-                 f'per={self.period_ms}ms ' \
-                 f'cur_per={self.period_at:.3f}:v{self.vperiod_at:.3f} ' \
-                 f'busy={self.busy_level:+3} ' \
-                 f'vrate={self.vrate_pct:6.2f}% ' \
-                 f'params={self.autop_name}'
-        if self.user_cost_model or self.user_qos_params:
-            output += f'({"C" if self.user_cost_model else ""}{"Q" if self.user_qos_params else ""})'
-        return output
+        key = self.stable_key()
+        if key != IocStat.preamble_key:
+            state = ('RUN' if self.running else 'IDLE') if self.enabled else 'OFF'
+            tail = f'params={self.autop_name}'
+            if self.user_cost_model or self.user_qos_params:
+                tail += f'({"C" if self.user_cost_model else ""}{"Q" if self.user_qos_params else ""})'
+            IocStat.preamble_key = key
+            IocStat.preamble_head = f'{devname} {state:4} per={self.period_ms}ms '
+            IocStat.preamble_tail = tail
+        return IocStat.preamble_head + \
+               f'cur_per={self.period_at:.3f}:v{self.vperiod_at:.3f} ' \
+               f'busy={self.busy_level:+3} ' \
+               f'vrate={self.vrate_pct:6.2f}% ' + \
+               IocStat.preamble_tail
 
     def table_header_str(self):
         return f'{"":25} active {"weight":>9} {"hweight%":>13} {"inflt%":>6} ' \
                f'{"dbt":>3} {"delay":>6} {"usages%"}'
 
 class IocgStat:
+    __slots__ = ('is_active', 'weight', 'active', 'inuse', 'hwa_pct',
+                 'hwi_pct', 'address', 'inflight_pct', 'debt_ms',
+                 'use_delay', 'delay_ms', 'usages', 'usage')
+
     def __init__(self, iocg):
-        ioc = iocg.ioc
-        blkg = iocg.pd.blkg
-
-        self.is_active = not list_empty(iocg.active_list.address_of_())
-        self.weight = iocg.weight.value_()
-        self.active = iocg.active.value_()
-        self.inuse = iocg.inuse.value_()
-        self.hwa_pct = iocg.hweight_active.value_() * 100 / HWEIGHT_WHOLE
-        self.hwi_pct = iocg.hweight_inuse.value_() * 100 / HWEIGHT_WHOLE
-        self.address = iocg.value_()
-
-        vdone = iocg.done_vtime.counter.value_()
-        vtime = iocg.vtime.counter.value_()
-        vrate = ioc.vtime_rate.counter.value_()
-        period_vtime = ioc.period_us.value_() * vrate
+        # Three reads per iocg: its struct ioc_gq and snapshots of the
+        # owning struct ioc and struct blkcg_gq, both located from
+        # pointers decoded out of the first buffer.
+        addr = iocg.value_()
+        buf = prog.read(addr, IOC_GQ_SIZE)
+        ioc_buf = prog.read(read_field(buf, IOC_GQ_IOC), IOC_SIZE)
+        blkg_buf = prog.read(read_field(buf, IOC_GQ_PD_BLKG), BLKCG_GQ_SIZE)
+
+        self.is_active = read_field(buf, IOC_GQ_ACTIVE_NEXT) != \
+                         addr + IOC_GQ_ACTIVE_OFFSET
+        self.weight = read_field(buf, IOC_GQ_WEIGHT)
+        self.active = read_field(buf, IOC_GQ_ACTIVE)
+        self.inuse = read_field(buf, IOC_GQ_INUSE)
+        self.hwa_pct = read_field(buf, IOC_GQ_HWEIGHT_ACTIVE) * 100 / HWEIGHT_WHOLE
+        self.hwi_pct = read_field(buf, IOC_GQ_HWEIGHT_INUSE) * 100 / HWEIGHT_WHOLE
+        self.address = addr
+
+        vdone = read_field(buf, IOC_GQ_DONE_VTIME)
+        vtime = read_field(buf, IOC_GQ_VTIME)
+        vrate = read_field(ioc_buf, IOC_VTIME_RATE)
+        period_vtime = read_field(ioc_buf, IOC_PERIOD_US) * vrate
         if period_vtime:
             self.inflight_pct = (vtime - vdone) * 100 / period_vtime
         else:
             self.inflight_pct = 0
 
-        self.debt_ms = iocg.abs_vdebt.counter.value_() / VTIME_PER_USEC / 1000
-        self.use_delay = blkg.use_delay.counter.value_()
-        self.delay_ms = blkg.delay_nsec.counter.value_() / 1_000_000
-
-        usage_idx = iocg.usage_idx.value_()
-        self.usages = []
-        self.usage = 0
-        for i in range(NR_USAGE_SLOTS):
-            usage = iocg.usages[(usage_idx + i) % NR_USAGE_SLOTS].value_()
-            upct = usage * 100 / HWEIGHT_WHOLE
-            self.usages.append(upct)
-            self.usage = max(self.usage, upct)
+        self.debt_ms = read_field(buf, IOC_GQ_ABS_VDEBT) / VTIME_PER_USEC / 1000
+        self.use_delay = read_field(blkg_buf, BLKCG_GQ_USE_DELAY)
+        self.delay_ms = read_field(blkg_buf, BLKCG_GQ_DELAY_NSEC) / 1_000_000
+
+        usage_idx = read_field(buf, IOC_GQ_USAGE_IDX)
+        usages_off, usages_fmt = IOC_GQ_USAGES
+        if np is not None:
+            arr = np.frombuffer(buf, dtype=np.uint32, count=NR_USAGE_SLOTS,
+                                offset=usages_off)
+            upcts = np.roll(arr, -usage_idx) * (100 / HWEIGHT_WHOLE)
+            self.usages = upcts.tolist()
+            self.usage = float(upcts.max())
+        else:
+            usages = usages_fmt.unpack_from(buf, usages_off)
+            self.usages = []
+            self.usage = 0
+            for i in range(NR_USAGE_SLOTS):
+                upct = usages[(usage_idx + i) % NR_USAGE_SLOTS] * 100 \
+                       / HWEIGHT_WHOLE
+                self.usages.append(upct)
+                self.usage = max(self.usage, upct)
 
     def dict(self, now, path):
         out = { 'cgroup'                : path,
-                'timestamp'             : str(now),
-                'is_active'             : str(int(self.is_active)),
-                'weight'                : str(self.weight),
-                'weight_active'         : str(self.active),
-                'weight_inuse'          : str(self.inuse),
-                'hweight_active_pct'    : str(self.hwa_pct),
-                'hweight_inuse_pct'     : str(self.hwi_pct),
-                'inflight_pct'          : str(self.inflight_pct),
-                'debt_ms'               : str(self.debt_ms),
-                'use_delay'             : str(self.use_delay),
-                'delay_ms'              : str(self.delay_ms),
-                'usage_pct'             : str(self.usage),
-                'address'               : str(hex(self.address)) }
+                'timestamp'             : now,
+                'is_active'             : int(self.is_active),
+                'weight'                : self.weight,
+                'weight_active'         : self.active,
+                'weight_inuse'          : self.inuse,
+                'hweight_active_pct'    : self.hwa_pct,
+                'hweight_inuse_pct'     : self.hwi_pct,
+                'inflight_pct'          : self.inflight_pct,
+                'debt_ms'               : self.debt_ms,
+                'use_delay'             : self.use_delay,
+                'delay_ms'              : self.delay_ms,
+                'usage_pct'             : self.usage,
+                'address'               : hex(self.address) }
         for i in range(len(self.usages)):
-            out[f'usage_pct_{i}'] = str(self.usages[i])
+            out[f'usage_pct_{i}'] = self.usages[i]
         return out
 
     def table_row_str(self, path):
-        out = f'{path[-28:]:28} ' \
-              f'{"*" if self.is_active else " "} ' \
-              f'{self.inuse:5}/{self.active:5} ' \
-              f'{self.hwi_pct:6.2f}/{self.hwa_pct:6.2f} ' \
-              f'{self.inflight_pct:6.2f} ' \
-              f'{min(math.ceil(self.debt_ms), 999):3} ' \
-              f'{min(self.use_delay, 99):2}*'\
-              f'{min(math.ceil(self.delay_ms), 999):03} '
-        for u in self.usages:
-            out += f'{min(round(u), 999):03d}:'
-        out = out.rstrip(':')
-        return out
+        parts = [f'{path[-28:]:28} '
+                 f'{"*" if self.is_active else " "} '
+                 f'{self.inuse:5}/{self.active:5} '
+                 f'{self.hwi_pct:6.2f}/{self.hwa_pct:6.2f} '
+                 f'{self.inflight_pct:6.2f} '
+                 f'{min(math.ceil(self.debt_ms), 999):3} '
+                 f'{min(self.use_delay, 99):2}*'
+                 f'{min(math.ceil(self.delay_ms), 999):03} ']
+        parts.extend(f'{min(round(u), 999):03d}:' for u in self.usages)
+        return ''.join(parts).rstrip(':')
 
 # handle args
 table_fmt = not args.json
@@ -213,28 +374,30 @@ devname = args.devname
 if args.json:
     table_fmt = False
 
-re_str = None
-if args.cgroup:
-    for r in args.cgroup:
-        if re_str is None:
-            re_str = r
-        else:
-            re_str += '|' + r
+# google-re2 matches with a DFA rather than backtracking, which keeps
+# many-pattern alternations linear.  Fall back to stdlib re.
+try:
+    import re2 as re_mod
+except ImportError:
+    re_mod = re
 
-filter_re = re.compile(re_str) if re_str else None
+filter_re = None
+if args.cgroup:
+    # Compiled as bytes so it can match the undecoded walk paths.
+    filter_re = re_mod.compile(('^(?:' + '|'.join(args.cgroup) + ')').encode('utf-8'))
 
 # Locate the roots
-q_id = None
+q = None
 root_iocg = None
 ioc = None
 
 for i, ptr in radix_tree_for_each(blkcg_root.blkg_tree):
-    blkg = drgn.Object(prog, 'struct blkcg_gq', address=ptr)
+    blkg = drgn.Object(prog, BLKCG_GQ_T, address=ptr)
     try:
         if devname == blkg.q.kobj.parent.name.string_().decode('utf-8'):
-            q_id = blkg.q.id.value_()
+            q = blkg.q
             if blkg.pd[plid]:
-                root_iocg = container_of(blkg.pd[plid], 'struct ioc_gq', 'pd')
+                root_iocg = pd_to_iocg(blkg.pd[plid])
                 ioc = root_iocg.ioc
             break
     except:
@@ -243,35 +406,60 @@ for i, ptr in radix_tree_for_each(blkcg_root.blkg_tree):
 if ioc is None:
     err(f'Could not find ioc for {devname}');
 
+def iocg_stat_row(path_iocg):
+    path, iocg = path_iocg
+    return path, IocgStat(iocg)
+
 # Keep printing
+blkg_iter = BlkgIterator(blkcg_root, q, refresh_every=args.refresh_every)
+
+# The per-iocg reads block in drgn's C memory accessors with the GIL
+# released, so a small thread pool overlaps them across iocgs.
+stat_pool = ThreadPoolExecutor(max_workers=8)
+
+# Sleep towards absolute deadlines on the monotonic clock so that the
+# sampling cadence doesn't drift with the cost of each pass.
+start_at = time.monotonic()
+ticks = 0
 while True:
     now = time.time()
+    blkg_iter.refresh()
     iocstat = IocStat(ioc)
-    output = ''
+    lines = []
 
     if table_fmt:
-        output += '\n' + iocstat.table_preamble_str()
-        output += '\n' + iocstat.table_header_str()
+        lines.append('')
+        lines.append(iocstat.table_preamble_str())
+        lines.append(iocstat.table_header_str())
     else:
-        output += json.dumps(iocstat.dict(now))
+        lines.append(json_dumps(iocstat.dict(now)))
 
-    for path, blkg in BlkgIterator(blkcg_root, q_id):
+    targets = []
+    for path, blkg in blkg_iter:
         if filter_re and not filter_re.match(path):
             continue
-        if not blkg.pd[plid]:
+        pd = blkg.pd[plid]
+        if not pd:
             continue
 
-        iocg = container_of(blkg.pd[plid], 'struct ioc_gq', 'pd')
-        iocg_stat = IocgStat(iocg)
+        iocg = pd_to_iocg(pd)
 
-        if not filter_re and not iocg_stat.is_active:
+        # Idle cgroups are usually the majority.  Skip the whole stat
+        # read batch for them unless a filter asked to see them.
+        if not filter_re and list_empty(iocg.active_list.address_of_()):
             continue
 
+        targets.append((path, iocg))
+
+    # map() preserves input order, so rows come out in walk order.
+    for path, iocg_stat in stat_pool.map(iocg_stat_row, targets):
+        path = path.decode('utf-8')
         if table_fmt:
-            output += '\n' + iocg_stat.table_row_str(path)
+            lines.append(iocg_stat.table_row_str(path))
         else:
-            output += '\n' + json.dumps(iocg_stat.dict(now, path))
+            lines.append(json_dumps(iocg_stat.dict(now, path)))
 
-    print(output)
+    sys.stdout.write('\n'.join(lines) + '\n')
     sys.stdout.flush()
-    time.sleep(interval)
+    ticks += 1
+    time.sleep(max(0, start_at + ticks * interval - time.monotonic()))